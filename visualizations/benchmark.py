@@ -0,0 +1,162 @@
+import math
+import os
+import string
+import tempfile
+from timeit import default_timer as timer
+
+import folium
+import numpy as np
+import pandas as pd
+
+from visualizations import REPORT_FIGURES, CoverageReport, dot_maps
+
+# Benchmarks of the visualizations on synthetic data.
+# Run from this folder with: python benchmark.py
+
+
+def random_names(rng, n):
+    letters = np.array(list(string.ascii_lowercase))
+    return [''.join(rng.choice(letters, size=rng.integers(4, 12))) for _ in range(n)]
+
+
+def synthetic_cities(n_cities, n_countries=150, seed=0):
+    '''
+    Creates a dataframe of cities shaped like twitter_coverage_cities.csv
+    '''
+    rng = np.random.default_rng(seed)
+    n_users = rng.integers(1, 100000, n_cities)
+    population = rng.uniform(3e5, 3e7, n_cities)
+    return pd.DataFrame({'locality_long': random_names(rng, n_cities),
+                         'country_long': rng.choice(random_names(rng, n_countries), n_cities),
+                         'latitude': rng.uniform(-60, 70, n_cities),
+                         'longitude': rng.uniform(-180, 180, n_cities),
+                         'n_users': n_users,
+                         'population': population,
+                         'users_per_K': n_users / population * 1000})
+
+
+def dot_maps_loop(dataframe, map_name, total_users=True):
+    '''
+    dot_maps as it was before CircleMarkerLayer: one CircleMarker per city, filtering the cities of
+    each country
+    '''
+    var = 'n_users' if total_users else 'users_per_K'
+    map_city = folium.Map(location=[0, 0], zoom_start=2, tiles='cartodbpositron')
+    for country in dataframe.country_long.unique():
+        for i, (city, lat, lon, users) in enumerate(zip(
+                dataframe.loc[dataframe.country_long == country, 'locality_long'],
+                dataframe.loc[dataframe.country_long == country, 'latitude'],
+                dataframe.loc[dataframe.country_long == country, 'longitude'],
+                dataframe.loc[dataframe.country_long == country, var])):
+            folium.CircleMarker(
+                [lat, lon],
+                radius=0.01*math.sqrt(users) if total_users else 0.05*(users),
+                fill=True,
+                fill_opacity=0.5,
+                color='k',
+                tooltip=city.title() + ' (' + '{}'.format(users) + ' Users)' if total_users else city.title() + ' (' + '{0:.2f}'.format(users) + ' Users per 1K people)'
+            ).add_to(map_city)
+    map_city.save("./pictures/{}.html".format(map_name))
+    return map_city
+
+
+def html_size(map_name):
+    return os.path.getsize("./pictures/{}.html".format(map_name)) / 1024 ** 2
+
+
+def benchmark_dot_maps(sizes=(10000, 100000), max_loop_size=10000):
+    '''
+    Times the building and saving of the dot map, and the size of the HTML file. The loop is only
+    run up to max_loop_size cities, as it takes minutes beyond
+    '''
+    for n_cities in sizes:
+        cities = synthetic_cities(n_cities)
+        print('Dot map ({} cities)'.format(n_cities))
+        if n_cities <= max_loop_size:
+            start = timer()
+            dot_maps_loop(cities, 'loop')
+            loop_time = timer() - start
+            print('    loop:         {:.2f} sec, {:.1f} MB'.format(loop_time, html_size('loop')))
+        for name, kwargs in [('single layer', {}), ('cluster', {'cluster': True})]:
+            start = timer()
+            dot_maps(cities, 'layer', **kwargs)
+            print('    {:13} {:.2f} sec, {:.1f} MB'.format(name + ':', timer() - start, html_size('layer')))
+
+
+def synthetic_coverage(folder, n_countries=200, n_cities=10000, seed=0):
+    '''
+    Writes coverage CSVs shaped like twitter_coverage_countries.csv and twitter_coverage_cities.csv
+    '''
+    rng = np.random.default_rng(seed)
+    countries = synthetic_cities(n_countries, n_countries, seed)[['country_long', 'n_users', 'population',
+                                                                   'users_per_K']]
+    countries['country_long'] = random_names(rng, n_countries)
+    countries['gdp_2019'] = rng.uniform(300, 100000, n_countries)
+    cities = synthetic_cities(n_cities, n_countries, seed)
+    cities['match_city'] = ''
+    countries_path = os.path.join(folder, 'countries.csv')
+    cities_path = os.path.join(folder, 'cities.csv')
+    countries.to_csv(countries_path)
+    cities.to_csv(cities_path)
+    return countries_path, cities_path
+
+
+def report_figures():
+    '''
+    The charts of a set of dashboards: each top-k chart for several values of k and both sortings
+    '''
+    figures = [('gdp_and_users', 'plot_gdp_and_users', {})]
+    for figure, (_, _, top_k_arg, sort_arg) in REPORT_FIGURES.items():
+        if top_k_arg is None:
+            continue
+        for top_k in (10, 20, 50):
+            for sort in (True, False):
+                figures.append(('{}_{}_{}'.format(figure, top_k, sort), figure, {top_k_arg: top_k, sort_arg: sort}))
+    return figures
+
+
+def render_figures_loop(countries_path, cities_path, figures):
+    '''
+    The figures rendered one by one, as in the notebooks: the data is read and sorted for each
+    chart, and each HTML file embeds plotly.js
+    '''
+    for fig_name, figure, kwargs in figures:
+        builder, table, _, _ = REPORT_FIGURES[figure]
+        data = pd.read_csv(countries_path if table == 'countries' else cities_path, index_col=0)
+        builder(data, **kwargs).write_html("./pictures/{}.html".format(fig_name))
+
+
+def folder_size(folder):
+    return sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder)) / 1024 ** 2
+
+
+def benchmark_report(n_workers=os.cpu_count()):
+    countries_path, cities_path = synthetic_coverage('.')
+    figures = report_figures()
+    print('Report ({} figures)'.format(len(figures)))
+
+    os.mkdir('loop')
+    os.chdir('loop')
+    os.mkdir('pictures')
+    start = timer()
+    render_figures_loop(os.path.join('..', countries_path), os.path.join('..', cities_path), figures)
+    loop_time = timer() - start
+    print('    loop:         {:.2f} sec, {:.1f} MB'.format(loop_time, folder_size('pictures')))
+    os.chdir('..')
+
+    for workers in (1, n_workers):
+        output_dir = 'report_{}'.format(workers)
+        start = timer()
+        CoverageReport(countries_path, cities_path).render(figures, output_dir, n_workers=workers)
+        report_time = timer() - start
+        print('    {:13} {:.2f} sec, {:.1f} MB ({:.0f}x faster)'.format(
+            'report ({}):'.format(workers), report_time, folder_size(output_dir), loop_time / report_time))
+
+
+if __name__ == '__main__':
+    # The maps are written to ./pictures, so they are built in a temporary folder
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        os.mkdir('pictures')
+        benchmark_dot_maps()
+        benchmark_report()
@@ -0,0 +1,147 @@
+import string
+from timeit import default_timer as timer
+
+import numpy as np
+import pandas as pd
+from fuzzywuzzy import fuzz
+
+from city_matching import CityMatcher
+from process_data import country_aggregate
+from reference_data import enrich_cities, enrich_countries
+
+# Benchmarks of the processing steps of process_data.py on synthetic data.
+# Run from this folder with: python benchmark.py
+
+
+def random_names(rng, n):
+    letters = np.array(list(string.ascii_lowercase))
+    return [''.join(rng.choice(letters, size=rng.integers(4, 12))).title() for _ in range(n)]
+
+
+def synthetic_cities(n_wup=1800, n_users=9000, seed=0):
+    '''
+    Creates a WUP-like table of agglomerations and a table of user cities, a share of which
+    are noisy copies of the agglomerations
+    '''
+    rng = np.random.default_rng(seed)
+    city_population = pd.DataFrame({'Urban Agglomeration': random_names(rng, n_wup),
+                                    'Latitude': rng.uniform(-60, 70, n_wup),
+                                    'Longitude': rng.uniform(-180, 180, n_wup),
+                                    2020: rng.uniform(300, 30000, n_wup)})
+    copies = city_population.sample(n_users // 3, random_state=seed)
+    data_by_city = pd.DataFrame({
+        'locality_long': copies['Urban Agglomeration'].to_list() + random_names(rng, n_users - len(copies)),
+        'latitude': np.concatenate([copies['Latitude'] + rng.normal(0, 0.2, len(copies)),
+                                    rng.uniform(-60, 70, n_users - len(copies))]),
+        'longitude': np.concatenate([copies['Longitude'] + rng.normal(0, 0.2, len(copies)),
+                                     rng.uniform(-180, 180, n_users - len(copies))]),
+        'n_users': rng.integers(1, 100000, n_users)})
+    return city_population, data_by_city
+
+
+def match_names_loop(data_by_city, city_population, min_score=80):
+    '''
+    City matching as it was done in process_data.py before CityMatcher
+    '''
+    def match_names(name, list_names):
+        max_score = -1
+        max_name = ''
+        for x in list_names:
+            score = fuzz.partial_ratio(name.lower(), x.lower())
+            if (score > min_score) & (score > max_score):
+                max_name = x
+                max_score = score
+        return max_name
+
+    dict_matches = {}
+    for city in data_by_city["locality_long"]:
+        match = match_names(city, city_population["Urban Agglomeration"].to_list())
+        try:
+            lat_pop = city_population[city_population['Urban Agglomeration'] == match].iloc[0]['Latitude']
+            long_pop = city_population[city_population['Urban Agglomeration'] == match].iloc[0]['Longitude']
+            lat_users = data_by_city[data_by_city["locality_long"] == city].iloc[0]['latitude']
+            long_users = data_by_city[data_by_city["locality_long"] == city].iloc[0]['longitude']
+            if (abs(lat_pop - lat_users) < 1) & (abs(long_pop - long_users) < 1):
+                dict_matches[city] = match
+            else:
+                dict_matches[city] = ''
+        except:
+            dict_matches[city] = ''
+    return dict_matches
+
+
+def benchmark_city_matching(n_wup=1800, n_users=500):
+    city_population, data_by_city = synthetic_cities(n_wup, n_users)
+
+    start = timer()
+    loop_matches = match_names_loop(data_by_city, city_population)
+    loop_time = timer() - start
+
+    start = timer()
+    indexed_matches = CityMatcher(city_population).match_all(data_by_city)
+    indexed_time = timer() - start
+
+    same = sum(loop_matches[city] == indexed_matches[city] for city in loop_matches)
+    print('City matching ({} cities, {} agglomerations)'.format(n_users, n_wup))
+    print('    loop:    {:.2f} sec'.format(loop_time))
+    print('    indexed: {:.2f} sec ({:.0f}x faster)'.format(indexed_time, loop_time / indexed_time))
+    print('    identical matches: {} / {}'.format(same, len(loop_matches)))
+
+
+def synthetic_geocoded_users(n_locations=200000, n_countries=200, n_cities=20000, seed=0):
+    '''
+    Creates geocoded user locations, and population, GDP and WUP lookups covering their countries
+    and cities
+    Returns:
+        geocoded_users (dataframe), population (series), gdp (series), city_table (dataframe)
+    '''
+    rng = np.random.default_rng(seed)
+    countries = random_names(rng, n_countries)
+    cities = pd.DataFrame({'locality_long': random_names(rng, n_cities),
+                           'country_long': rng.choice(countries, n_cities),
+                           'latitude': rng.uniform(-60, 70, n_cities),
+                           'longitude': rng.uniform(-180, 180, n_cities)})
+    geocoded_users = cities.iloc[rng.integers(0, n_cities, n_locations)].reset_index(drop=True)
+    geocoded_users['n_users'] = rng.integers(1, 1000, n_locations)
+    population = pd.Series(rng.integers(100000, 100000000, n_countries), index=countries).astype(str)
+    gdp = pd.Series(rng.uniform(300, 100000, n_countries), index=countries).astype(object)
+    city_table = pd.DataFrame({'population': rng.uniform(3e5, 3e7, n_cities),
+                               'country': cities['country_long'].to_numpy()},
+                              index=cities['locality_long'].to_numpy())
+    city_table = city_table[~city_table.index.duplicated(keep='last')]
+    return geocoded_users, population, gdp, city_table
+
+
+def cities_of(geocoded_users):
+    '''
+    Groups the geocoded users by city, as city_match does before matching
+    '''
+    data_by_city = geocoded_users.groupby(['locality_long', 'country_long', 'latitude', 'longitude'])\
+        [['n_users']].sum().reset_index()
+    data_by_city['match_city'] = ''
+    return data_by_city
+
+
+def benchmark_stages(n_locations=200000, n_countries=200, n_cities=20000, seed=0):
+    '''
+    Times the aggregation and enrichment stages of process_data.py on synthetic geocoded users
+    '''
+    geocoded_users, population, gdp, city_table = synthetic_geocoded_users(n_locations, n_countries, n_cities,
+                                                                           seed)
+
+    print('Stages ({} locations, {} cities)'.format(n_locations, n_cities))
+    start = timer()
+    data_by_country = country_aggregate(geocoded_users)
+    print('    country_aggregate: {:.2f} sec'.format(timer() - start))
+    start = timer()
+    enrich_countries(data_by_country, population, gdp)
+    print('    enrich_countries:  {:.2f} sec'.format(timer() - start))
+    data_by_city = cities_of(geocoded_users)
+    start = timer()
+    enrich_cities(data_by_city, city_table)
+    print('    enrich_cities:     {:.2f} sec'.format(timer() - start))
+
+
+if __name__ == '__main__':
+    benchmark_city_matching()
+    benchmark_stages()
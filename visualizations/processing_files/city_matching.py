@@ -0,0 +1,138 @@
+import math
+from collections import defaultdict
+
+import numpy as np
+from fuzzywuzzy import fuzz
+from tqdm import tqdm
+
+
+class CityMatcher:
+    '''
+    Matches the cities found in the users' profile locations with the WUP "Urban Agglomeration" names.
+    By default, a city is matched with the best scoring name of all WUP, if that agglomeration is
+    less than `max_distance` degrees away from it (otherwise it is not matched), as process_data.py
+    always did. Only the names whose score can beat the best one found so far are scored, using
+    an upper bound of the scores computed from the characters of the names.
+    With nearest_candidate=True, the WUP cities are indexed on a latitude/longitude grid and each
+    city is matched with the best scoring agglomeration among those less than `max_distance`
+    degrees away, even when a name further away scores higher.
+    Inputs:
+        city_population (dataframe): WUP cities with the 'Urban Agglomeration', 'Latitude' and
+        'Longitude' columns
+        min_score (int): minimum fuzz.partial_ratio score for a name to be considered a match
+        max_distance (float): maximum difference (in degrees) in latitude and in longitude between
+        the two cities
+        nearest_candidate (bool): If True, only the agglomerations close to the city are candidates
+    '''
+
+    def __init__(self, city_population, min_score=80, max_distance=1, nearest_candidate=False):
+        self.min_score = min_score
+        self.max_distance = max_distance
+        self.nearest_candidate = nearest_candidate
+        self.names = city_population['Urban Agglomeration'].to_list()
+        # Names are lowercased once here instead of once per comparison
+        self.lower_names = [str(name).lower() for name in self.names]
+        self.latitudes = city_population['Latitude'].astype(float).to_list()
+        self.longitudes = city_population['Longitude'].astype(float).to_list()
+        # Grid cells are as wide as the maximum distance, so the 3x3 block around a city
+        # contains every candidate
+        self.grid = defaultdict(list)
+        for position, (lat, lon) in enumerate(zip(self.latitudes, self.longitudes)):
+            if not (math.isnan(lat) or math.isnan(lon)):
+                self.grid[self._cell(lat, lon)].append(position)
+        # Number of occurrences of each character in each name, to bound the scores
+        self.alphabet = {char: i for i, char in enumerate(sorted(set(''.join(self.lower_names))))}
+        self.char_counts = np.zeros((len(self.names), len(self.alphabet)), dtype=np.int32)
+        for position, name in enumerate(self.lower_names):
+            for char in name:
+                self.char_counts[position, self.alphabet[char]] += 1
+        self.lengths = np.array([len(name) for name in self.lower_names])
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.max_distance), math.floor(lon / self.max_distance)
+
+    def candidates(self, lat, lon):
+        '''
+        Returns the positions (in WUP order) of the agglomerations close to a given point
+        '''
+        row, col = self._cell(lat, lon)
+        positions = sorted(position for d_row in (-1, 0, 1) for d_col in (-1, 0, 1)
+                           for position in self.grid.get((row + d_row, col + d_col), ()))
+        return [position for position in positions
+                if (abs(self.latitudes[position] - lat) < self.max_distance) &
+                (abs(self.longitudes[position] - lon) < self.max_distance)]
+
+    def score_bounds(self, name):
+        '''
+        Returns upper bounds of the fuzz.partial_ratio scores of a lowercased name against every WUP name.
+        partial_ratio compares the shorter string (of length m) with substrings of the longer one, and
+        at most c characters match, c being the number of characters the strings have in common, so the
+        score is at most 200 * c / (m + c)
+        '''
+        counts = np.zeros(len(self.alphabet), dtype=np.int32)
+        for char in name:
+            if char in self.alphabet:
+                counts[self.alphabet[char]] += 1
+        common = np.minimum(self.char_counts, counts).sum(axis=1)
+        shorter = np.minimum(self.lengths, len(name))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.nan_to_num(np.ceil(200 * common / (shorter + common)))
+
+    def best_match(self, name):
+        '''
+        Returns the position of the best scoring WUP name for a lowercased name (the first one in case
+        of a tie), or None if no score is above min_score
+        '''
+        bounds = self.score_bounds(name)
+        best_score, best_position = self.min_score, None
+        # The names are scored by decreasing bound, until none of the remaining ones can win
+        for position in np.argsort(-bounds, kind='stable'):
+            if bounds[position] < (best_score if best_position is not None else self.min_score + 1):
+                break
+            score = fuzz.partial_ratio(name, self.lower_names[position])
+            if score <= self.min_score:
+                continue
+            if best_position is None or score > best_score or (score == best_score and position < best_position):
+                best_score, best_position = score, position
+        return best_position
+
+    def match(self, name, lat, lon):
+        '''
+        Returns the matching agglomeration name of a city located at (lat, lon), or '' if there is none
+        '''
+        name = name.lower()
+        if self.nearest_candidate:
+            max_score = -1
+            max_name = ''
+            for position in self.candidates(lat, lon):
+                score = fuzz.partial_ratio(name, self.lower_names[position])
+                if (score > self.min_score) & (score > max_score):
+                    max_name = self.names[position]
+                    max_score = score
+            return max_name
+        position = self.best_match(name)
+        if position is None:
+            return ''
+        if (abs(self.latitudes[position] - lat) < self.max_distance) & \
+                (abs(self.longitudes[position] - lon) < self.max_distance):
+            return self.names[position]
+        return ''
+
+    def match_all(self, data_by_city, manual_matches=None):
+        '''
+        Matches every city of a dataframe grouped by city
+        Inputs:
+            data_by_city (dataframe): dataframe with 'locality_long', 'latitude' and 'longitude' columns
+            manual_matches (dict): matches set by hand, which override the computed ones
+        Returns:
+            Dictionary mapping each 'locality_long' to its agglomeration name ('' if not matched)
+        '''
+        # A city name appearing several times is located using its first row
+        cities = data_by_city.drop_duplicates('locality_long')
+        dict_matches = {}
+        for city, lat, lon in tqdm(zip(cities['locality_long'], cities['latitude'], cities['longitude']),
+                                   total=len(cities)):
+            dict_matches[city] = self.match(city, lat, lon)
+        if manual_matches is not None:
+            dict_matches.update(manual_matches)
+        return dict_matches
@@ -0,0 +1,77 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+def list_part_files(data_path):
+    '''
+    Lists the parquet part files of a directory, leaving out Spark's _SUCCESS marker and hidden files
+    '''
+    return sorted(os.path.join(data_path, f) for f in os.listdir(data_path)
+                  if os.path.isfile(os.path.join(data_path, f))
+                  and "SUCCESS" not in f and not f.startswith(('.', '_')))
+
+
+def _check_part_file(filename, columns):
+    try:
+        schema = pq.read_schema(filename)
+    except Exception as e:
+        return {'file': filename, 'error': type(e).__name__, 'message': str(e)}
+    missing = [column for column in columns if column not in schema.names]
+    if missing:
+        return {'file': filename, 'error': 'MissingColumns', 'message': ', '.join(missing)}
+    return None
+
+
+def _sum_by_location(table, key, value):
+    # The columns are selected by name, as their order in the aggregate depends on the pyarrow version
+    summed = table.group_by(key).aggregate([(value, 'sum')])
+    return summed.select([key, '{}_sum'.format(value)]).rename_columns([key, value])
+
+
+def read_users_by_location(data_path, columns=('location', 'n_users'), aggregate=True,
+                           max_workers=None, batch_size=1 << 20, flush_every=16):
+    '''
+    Reads the parquet part files of a directory as a single pyarrow dataset
+    Inputs:
+        data_path (str): directory containing the part files
+        columns (tuple): columns to read; with aggregate=True, the first one is the grouping key
+        and the second one the value summed
+        aggregate (bool): If True, the value is summed by key while the batches are streamed, so the
+        full table is never held in memory; if False, all the rows are returned
+        max_workers (int): number of threads used to check the files (pyarrow uses its own pool to read)
+        batch_size (int): maximum number of rows per streamed batch
+        flush_every (int): number of partial aggregates kept before they are merged together
+    Returns:
+        Pandas dataframe, and a dataframe listing the skipped files with the reason why
+    '''
+    columns = list(columns)
+    files = list_part_files(data_path)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        checks = list(executor.map(lambda f: _check_part_file(f, columns), files))
+    errors = pd.DataFrame([check for check in checks if check is not None],
+                          columns=['file', 'error', 'message'])
+    valid_files = [f for f, check in zip(files, checks) if check is None]
+    if not valid_files:
+        return pd.DataFrame(columns=columns), errors
+
+    dataset = ds.dataset(valid_files, format='parquet')
+    scanner = dataset.scanner(columns=columns, use_threads=True, batch_size=batch_size)
+    if not aggregate:
+        return scanner.to_table().to_pandas(), errors
+
+    key, value = columns[:2]
+    partials = []
+    for batch in scanner.to_batches():
+        if batch.num_rows == 0:
+            continue
+        partials.append(_sum_by_location(pa.Table.from_batches([batch]), key, value))
+        if len(partials) >= flush_every:
+            partials = [_sum_by_location(pa.concat_tables(partials), key, value)]
+    if not partials:
+        return pd.DataFrame(columns=[key, value]), errors
+    return _sum_by_location(pa.concat_tables(partials), key, value).to_pandas(), errors
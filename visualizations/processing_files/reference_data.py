@@ -0,0 +1,103 @@
+import pandas as pd
+
+
+def normalize_country_names(names, rename_dict):
+    '''
+    Renames the World Bank country names to the names returned by the geocoder
+    Inputs:
+        names (series): country names
+        rename_dict (dict): World Bank name -> geocoder name
+    Returns:
+        Series of normalized country names
+    '''
+    return names.map(rename_dict).fillna(names)
+
+
+def country_indicator(data, column, rename_dict=None):
+    '''
+    Builds a lookup series of a country-level indicator indexed by the normalized country name.
+    When several rows get the same name, the last one is kept
+    '''
+    names = data["country_name"]
+    if rename_dict is not None:
+        names = normalize_country_names(names, rename_dict)
+    indicator = pd.Series(data[column].to_numpy(), index=names.to_numpy())
+    return indicator[~indicator.index.duplicated(keep='last')]
+
+
+def load_country_population(country_pop_path, missing_countries_path, rename_dict):
+    '''
+    Loads the population by country from World Bank's WDI, completed by UN data for the missing countries
+    Returns:
+        Series of population (as reported, possibly with spaces) indexed by country name
+    '''
+    # We use data from World Bank's WDI
+    country_pop = pd.read_csv(country_pop_path)
+    country_pop = country_pop.rename({"Country Name": "country_name", "Country Code": "country_code", "2020 [YR2020]":"population"},
+                      axis = "columns" )[["country_name","country_code","population"]]
+    # And UN for some missing countries
+    missing_countries = pd.read_csv(missing_countries_path)
+    population = pd.concat([country_indicator(country_pop, "population", rename_dict),
+                            country_indicator(missing_countries, "population")])
+    return population[~population.index.duplicated(keep='last')]
+
+
+def load_gdp(gdp_path, rename_dict):
+    '''
+    Loads the 2019 GDP per capita by country from World Bank's WDI
+    Returns:
+        Series of GDP per capita (as reported, '..' when missing) indexed by country name
+    '''
+    gdp = pd.read_csv(gdp_path)
+    gdp = gdp.rename({"Country Name": "country_name", "Country Code": "country_code", "2019 [YR2019]":"gdp_2019"},
+                      axis = "columns" )[["country_name","country_code","gdp_2019"]]
+    gdp = country_indicator(gdp, "gdp_2019", rename_dict).astype(object)
+    gdp["Venezuela"] = 2299 # Adding this missing val by hand
+    return gdp
+
+
+def city_population_table(city_population):
+    '''
+    Indexes the 2020 WUP population (in persons) and the country of each agglomeration by name
+    '''
+    table = pd.DataFrame({'population': city_population[2020].to_numpy() * 1000,
+                          'country': city_population["Country or area"].to_numpy()},
+                         index=city_population['Urban Agglomeration'].to_numpy())
+    return table[~table.index.duplicated(keep='last')]
+
+
+def enrich_countries(data_by_country, population, gdp):
+    '''
+    Adds the population, users per 1,000 people and GDP per capita to the dataframe grouped by country.
+    Countries without GDP data ('..') are dropped
+    '''
+    data_by_country = data_by_country.copy()
+    # A country missing from the population data is an error
+    missing = ~data_by_country['country_long'].isin(population.index)
+    if missing.any():
+        raise KeyError('No population for: {}'.format(', '.join(data_by_country.loc[missing, 'country_long'])))
+    population = data_by_country['country_long'].map(population)
+    data_by_country["population"] = population.astype(str).str.replace(" ", "").astype(int)
+    data_by_country["users_per_K"] = data_by_country["n_users"]/data_by_country["population"] * 1000
+    data_by_country["gdp_2019"] = data_by_country['country_long'].map(gdp)
+    data_by_country = data_by_country[data_by_country["gdp_2019"]!=".."]
+    data_by_country["gdp_2019"] = data_by_country["gdp_2019"].astype(float)
+    return data_by_country
+
+
+def enrich_cities(data_by_city, city_table):
+    '''
+    Adds the population and users per 1,000 people to the dataframe grouped by city.
+    A city takes the population of the agglomeration with the same name if it is in the same
+    country; otherwise, if its name is not a WUP agglomeration, the population of its match
+    '''
+    data_by_city = data_by_city.copy()
+    locality = data_by_city['locality_long']
+    in_table = locality.isin(city_table.index)
+    same_country = data_by_city["country_long"] == locality.map(city_table['country'])
+    population = locality.map(city_table['population']).where(in_table & same_country)
+    from_match = (data_by_city['match_city'] != "") & ~in_table
+    population = population.mask(from_match, data_by_city['match_city'].map(city_table['population']))
+    data_by_city['population'] = population.astype(float)
+    data_by_city["users_per_K"] = data_by_city["n_users"]/data_by_city["population"] * 1000
+    return data_by_city
@@ -0,0 +1,121 @@
+import hashlib
+import inspect
+import json
+import os
+import pickle
+
+
+def fingerprint_files(paths, hash_contents=False):
+    '''
+    Describes input files by their path, size and modification time (or by the hash of their content)
+    Inputs:
+        paths (list): file paths
+        hash_contents (bool): If True, hashes the content of the files, so that touching a file
+        without changing it does not invalidate the cache
+    Returns:
+        List of [path, size, mtime or sha256] lists
+    '''
+    fingerprints = []
+    for path in sorted(paths):
+        stat = os.stat(path)
+        if hash_contents:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as file:
+                for block in iter(lambda: file.read(1 << 20), b''):
+                    digest.update(block)
+            fingerprints.append([path, stat.st_size, digest.hexdigest()])
+        else:
+            fingerprints.append([path, stat.st_size, stat.st_mtime_ns])
+    return fingerprints
+
+
+def helper_files(function):
+    '''
+    Lists the source files of the local modules (next to the module of the function) providing the
+    functions and classes a function calls, e.g. city_matching.py for CityMatcher
+    '''
+    folder = os.path.dirname(os.path.abspath(inspect.getfile(function)))
+    paths = set()
+    for name in function.__code__.co_names:
+        module = inspect.getmodule(function.__globals__.get(name))
+        if module is None or module.__name__ == function.__module__ or not getattr(module, '__file__', None):
+            continue
+        if os.path.dirname(os.path.abspath(module.__file__)) == folder:
+            paths.add(module.__file__)
+    return sorted(paths)
+
+
+class StageCache:
+    '''
+    On-disk cache of the outputs of the processing stages, addressed by a hash of their inputs
+    Inputs:
+        cache_dir (str): directory where the stage outputs are pickled
+        max_bytes (int): size limit of the cache; the least recently used outputs are evicted
+        beyond it
+    '''
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, stage, function, inputs):
+        '''
+        Hashes the stage name, the source code of the stage function and of the helper modules it
+        calls, and its inputs
+        '''
+        try:
+            code = inspect.getsource(function)
+            helpers = [hash for _, _, hash in fingerprint_files(helper_files(function), hash_contents=True)]
+        except (OSError, TypeError):
+            code = function.__code__.co_code.hex()
+            helpers = []
+        description = json.dumps([stage, code, helpers, inputs], sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+    def path(self, stage, key):
+        return os.path.join(self.cache_dir, '{}-{}.pkl'.format(stage, key[:20]))
+
+    def run(self, stage, function, inputs, *args):
+        '''
+        Returns the cached output of a stage if its inputs did not change, computes and caches it otherwise
+        Inputs:
+            stage (str): stage name
+            function (callable): function computing the stage output from *args
+            inputs: JSON-serializable description of everything the output depends on (file
+            fingerprints, parameters, keys of the upstream stages)
+        Returns:
+            Stage output, and the stage key to pass to the downstream stages
+        '''
+        key = self.key(stage, function, inputs)
+        path = self.path(stage, key)
+        if os.path.exists(path):
+            print('Stage', stage, ': loaded from cache')
+            os.utime(path)
+            with open(path, 'rb') as file:
+                return pickle.load(file), key
+        print('Stage', stage, ': computing')
+        output = function(*args)
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as file:
+            pickle.dump(output, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+        self.evict(keep=path)
+        return output, key
+
+    def evict(self, keep=None):
+        '''
+        Deletes the least recently used outputs until the cache fits in max_bytes
+        '''
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith('.pkl'):
+                stat = os.stat(os.path.join(self.cache_dir, filename))
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(self.cache_dir, filename)))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path != keep:
+                os.remove(path)
+                total -= size
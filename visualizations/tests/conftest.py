@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The modules are run as scripts from their folder and import each other by name
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+VISUALIZATIONS_DIR = os.path.dirname(TESTS_DIR)
+PROCESSING_DIR = os.path.join(VISUALIZATIONS_DIR, 'processing_files')
+sys.path[:0] = [VISUALIZATIONS_DIR, PROCESSING_DIR]
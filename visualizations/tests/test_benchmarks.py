@@ -0,0 +1,98 @@
+import importlib.util
+import os
+
+import pytest
+
+from city_matching import CityMatcher
+from process_data import country_aggregate
+from reference_data import enrich_cities, enrich_countries
+from visualizations import CoverageReport, dot_maps
+
+# Benchmarks of the processing stages and of the charts on the synthetic data of the benchmark scripts.
+# They need pytest-benchmark. To catch regressions, save a baseline with
+#     python -m pytest visualizations/tests --benchmark-autosave
+# and compare the following runs to it with
+#     python -m pytest visualizations/tests --benchmark-compare --benchmark-compare-fail=mean:25%
+pytest.importorskip('pytest_benchmark')
+
+VISUALIZATIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_script(name, path):
+    # Both scripts are called benchmark.py, so they are loaded under different names
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+processing_benchmark = load_script('processing_benchmark',
+                                   os.path.join(VISUALIZATIONS_DIR, 'processing_files', 'benchmark.py'))
+visualizations_benchmark = load_script('visualizations_benchmark', os.path.join(VISUALIZATIONS_DIR, 'benchmark.py'))
+
+
+@pytest.fixture(scope='module')
+def stage_inputs():
+    return processing_benchmark.synthetic_geocoded_users()
+
+
+@pytest.fixture
+def pictures(tmp_path, monkeypatch):
+    # The charts are written to ./pictures
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('pictures')
+    return tmp_path / 'pictures'
+
+
+@pytest.mark.benchmark(group='processing')
+def test_country_aggregate(benchmark, stage_inputs):
+    geocoded_users = stage_inputs[0]
+    data_by_country = benchmark(country_aggregate, geocoded_users)
+    assert data_by_country['n_users'].sum() == geocoded_users['n_users'].sum()
+
+
+@pytest.mark.benchmark(group='processing')
+def test_enrich_countries(benchmark, stage_inputs):
+    geocoded_users, population, gdp, _ = stage_inputs
+    data_by_country = country_aggregate(geocoded_users)
+    enriched = benchmark(enrich_countries, data_by_country, population, gdp)
+    assert len(enriched) == len(data_by_country)
+    assert enriched['users_per_K'].notna().all()
+
+
+@pytest.mark.benchmark(group='processing')
+def test_enrich_cities(benchmark, stage_inputs):
+    geocoded_users, _, _, city_table = stage_inputs
+    data_by_city = processing_benchmark.cities_of(geocoded_users)
+    enriched = benchmark(enrich_cities, data_by_city, city_table)
+    assert len(enriched) == len(data_by_city)
+    assert enriched['population'].notna().any()
+
+
+@pytest.mark.benchmark(group='processing')
+def test_city_matcher(benchmark):
+    city_population, data_by_city = processing_benchmark.synthetic_cities(n_wup=1800, n_users=2000)
+    matches = benchmark(lambda: CityMatcher(city_population).match_all(data_by_city))
+    assert len(matches) == data_by_city['locality_long'].nunique()
+    # A third of the cities are noisy copies of WUP agglomerations
+    assert sum(match != '' for match in matches.values()) >= len(data_by_city) // 4
+
+
+@pytest.mark.benchmark(group='charts')
+@pytest.mark.parametrize('cluster', [False, True])
+def test_dot_maps(benchmark, pictures, cluster):
+    cities = visualizations_benchmark.synthetic_cities(10000)
+    benchmark(dot_maps, cities, 'dot_map', cluster=cluster)
+    # One marker per city used to take 7 MB for 10,000 cities
+    assert os.path.getsize(pictures / 'dot_map.html') < 1024 ** 2
+
+
+@pytest.mark.benchmark(group='charts')
+def test_coverage_report(benchmark, tmp_path):
+    countries_path, cities_path = visualizations_benchmark.synthetic_coverage(str(tmp_path))
+    figures = visualizations_benchmark.report_figures()
+    output_dir = tmp_path / 'report'
+    paths = benchmark(CoverageReport(countries_path, cities_path).render, figures, str(output_dir))
+    assert len(paths) == len(figures)
+    # plotly.js is written once (about 5 MB) instead of once per figure
+    assert sum(os.path.getsize(output_dir / name) for name in os.listdir(output_dir)) < 10 * 1024 ** 2
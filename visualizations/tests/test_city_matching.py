@@ -0,0 +1,42 @@
+import importlib.util
+import os
+
+import pandas as pd
+
+from city_matching import CityMatcher
+
+PROCESSING_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'processing_files')
+
+# processing_files/benchmark.py keeps the matching loop of process_data.py as it was before CityMatcher
+spec = importlib.util.spec_from_file_location('processing_benchmark', os.path.join(PROCESSING_DIR, 'benchmark.py'))
+processing_benchmark = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(processing_benchmark)
+
+
+def test_match_all_matches_loop():
+    city_population, data_by_city = processing_benchmark.synthetic_cities(n_wup=300, n_users=90)
+    # Agglomerations named like earlier ones in other places, and cities close to them: the best name
+    # is the first agglomeration's, which is too far away
+    namesakes = city_population[:20].assign(Latitude=lambda table: table['Latitude'] + 5)
+    city_population = pd.concat([city_population, namesakes], ignore_index=True)
+    data_by_city = pd.concat([data_by_city, pd.DataFrame({
+        'locality_long': namesakes['Urban Agglomeration'].to_list(),
+        'latitude': namesakes['Latitude'] + 0.5,
+        'longitude': namesakes['Longitude'] - 0.5,
+        'n_users': 1})], ignore_index=True)
+
+    loop_matches = processing_benchmark.match_names_loop(data_by_city, city_population)
+    assert CityMatcher(city_population).match_all(data_by_city) == loop_matches
+
+
+def test_far_name_wins():
+    city_population = pd.DataFrame({'Urban Agglomeration': ['Santiago', 'Santiago', 'Santiago de Chile'],
+                                    'Latitude': [42.9, -33.5, -33.5],
+                                    'Longitude': [-8.5, -70.7, -70.7]})
+    data_by_city = pd.DataFrame({'locality_long': ['Santiago', 'Santiago de Compostela'],
+                                 'latitude': [-33.4, 42.9], 'longitude': [-70.6, -8.5]})
+
+    # The best name is Spain's Santiago, more than 1 degree away from Chile's
+    assert CityMatcher(city_population).match_all(data_by_city) == {'Santiago': '', 'Santiago de Compostela': 'Santiago'}
+    assert CityMatcher(city_population, nearest_candidate=True).match_all(data_by_city) == \
+        {'Santiago': 'Santiago', 'Santiago de Compostela': 'Santiago'}
@@ -0,0 +1,185 @@
+import contextlib
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import process_data
+
+VISUALIZATIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROCESSING_DIR = os.path.join(VISUALIZATIONS_DIR, 'processing_files')
+RENAME_DICT = {'Venezuela, RB': 'Venezuela', 'Russian Federation': 'Russia'}
+
+
+def object_strings():
+    '''
+    The committed CSVs were produced before pandas stored strings in their own dtype, which the loops
+    below rely on (e.g. to set Venezuela's GDP in a column of strings)
+    '''
+    if 'infer_string' in dir(pd.options.future):
+        return pd.option_context('future.infer_string', False)
+    return contextlib.nullcontext()
+
+
+def enrich_loop(data_by_country, data_by_city, city_population, country_pop_path, missing_countries_path,
+                gdp_path, rename_dict):
+    '''
+    process_data.enrich as it was before reference_data.py
+    '''
+    data_by_country = data_by_country.copy()
+    data_by_city = data_by_city.copy()
+
+    country_pop = pd.read_csv(country_pop_path)
+    country_pop = country_pop.rename({"Country Name": "country_name", "Country Code": "country_code", "2020 [YR2020]":"population"},
+                      axis = "columns" )[["country_name","country_code","population"]]
+    missing_countries = pd.read_csv(missing_countries_path)
+
+    dict_pop = {}
+    for index, row in country_pop.iterrows():
+        if row["country_name"] in rename_dict.keys():
+            dict_pop[rename_dict[row["country_name"]]] = row["population"]
+        else:
+            dict_pop[row["country_name"]] = row["population"]
+    for index, row in missing_countries.iterrows():
+        dict_pop[row["country_name"]] = row["population"]
+
+    data_by_country["population"] = data_by_country['country_long'].apply(lambda x: (dict_pop[x]))
+    data_by_country["population"] = data_by_country["population"].apply(lambda x: x.replace(" ",""))
+    data_by_country["population"] = data_by_country["population"].apply(lambda x: int(x))
+    data_by_country["users_per_K"] = data_by_country["n_users"]/data_by_country["population"] * 1000
+
+    dict_city_population = {}
+    for index, row in city_population.iterrows():
+        l=[]
+        l.append(row[2020]*1000)
+        l.append(row["Country or area"])
+        dict_city_population[row['Urban Agglomeration']] = l
+
+    data_by_city['population']=None
+    for index, row in data_by_city.iterrows():
+        if row['match_city']=="":
+            try:
+                if row["country_long"] == dict_city_population[row['locality_long']][1]:
+                    data_by_city.at[index,'population'] = dict_city_population[row['locality_long']][0]
+            except:
+                pass
+        else:
+            try:
+                if row["country_long"] == dict_city_population[row['locality_long']][1]:
+                    data_by_city.at[index,'population'] = dict_city_population[row['locality_long']][0]
+            except:
+                data_by_city.at[index,'population'] = dict_city_population[row['match_city']][0]
+    data_by_city["users_per_K"] = data_by_city["n_users"]/data_by_city["population"] * 1000
+
+    gdp = pd.read_csv(gdp_path)
+    gdp = gdp.rename({"Country Name": "country_name", "Country Code": "country_code", "2019 [YR2019]":"gdp_2019"},
+                      axis = "columns" )[["country_name","country_code","gdp_2019"]]
+    dict_gdp = {}
+    for index, row in gdp.iterrows():
+        if row["country_name"] in rename_dict.keys():
+            dict_gdp[rename_dict[row["country_name"]]] = row["gdp_2019"]
+        else:
+            dict_gdp[row["country_name"]] = row["gdp_2019"]
+    dict_gdp["Venezuela"] = 2299
+
+    for index, row in data_by_country.iterrows():
+        try:
+            data_by_country.at[index,"gdp_2019"] = dict_gdp[row["country_long"]]
+        except:
+            data_by_country.at[index,"gdp_2019"] = np.nan
+    data_by_country = data_by_country[data_by_country["gdp_2019"]!=".."]
+    data_by_country["gdp_2019"] = data_by_country["gdp_2019"].apply(lambda x: float(x))
+    return data_by_country, data_by_city
+
+
+@pytest.fixture
+def reference_files(tmp_path):
+    '''
+    WDI population and GDP, and UN population files, with the formats of the real ones: numbers as
+    strings with spaces, '..' for missing values
+    '''
+    paths = {name: str(tmp_path / '{}.csv'.format(name)) for name in ['country_pop', 'missing_countries', 'gdp']}
+    pd.DataFrame({'Country Name': ['Venezuela, RB', 'Russian Federation', 'France', 'Aruba', 'France'],
+                  'Country Code': ['VEN', 'RUS', 'FRA', 'ABW', 'FRA'],
+                  '2020 [YR2020]': ['28 435 943', '144 104 080', '67 000 000', '106 766', '67 391 582']})\
+        .to_csv(paths['country_pop'], index=False)
+    pd.DataFrame({'country_name': ['Taiwan'], 'population': ['23 816 775']}).to_csv(paths['missing_countries'], index=False)
+    pd.DataFrame({'Country Name': ['Venezuela, RB', 'Russian Federation', 'France', 'Aruba'],
+                  'Country Code': ['VEN', 'RUS', 'FRA', 'ABW'],
+                  '2019 [YR2019]': ['..', '11497.6', '40494.9', '..']}).to_csv(paths['gdp'], index=False)
+    return paths
+
+
+@pytest.fixture
+def city_population():
+    return pd.DataFrame({'Country Code': [250, 250, 250, 643, 862, 724],
+                         'Country or area': ['France', 'France', 'France', 'Russian Federation',
+                                             'Venezuela (Bolivarian Republic of)', 'Spain'],
+                         'City Code': [1, 2, 3, 4, 5, 6],
+                         'Urban Agglomeration': ['Paris', 'Lyon', 'Lyon', 'Moscow', 'Caracas', 'Valencia'],
+                         'Note': None,
+                         'Latitude': [48.9, 45.8, 45.8, 55.8, 10.5, 39.5],
+                         'Longitude': [2.3, 4.8, 4.8, 37.6, -66.9, -0.4],
+                         2020: [11017.2, 1700.5, 1719.3, 12537.9, 2938.6, 832.9]})
+
+
+@pytest.fixture
+def data_by_country():
+    return pd.DataFrame({'country_long': ['France', 'Russia', 'Venezuela', 'Aruba', 'Taiwan'],
+                         'n_users': [3000000, 1500000, 1700000, 9000, 900000]})
+
+
+@pytest.fixture
+def data_by_city():
+    return pd.DataFrame({
+        # Own WUP population, with and without a match; match absent from WUP; not in WUP; same name in
+        # another country, with and without a match; WUP country name differing from the geocoder's
+        'locality_long': ['Paris', 'Lyon', 'Saint-Denis', 'Rouen', 'Valencia', 'Valencia', 'Moscow'],
+        'country_long': ['France', 'France', 'France', 'France', 'Venezuela', 'Venezuela', 'Russia'],
+        'latitude': [48.86, 45.76, 48.94, 49.44, 10.16, 10.17, 55.76],
+        'longitude': [2.35, 4.84, 2.36, 1.1, -68.0, -68.1, 37.62],
+        'n_users': [900000, 200000, 50000, 30000, 80000, 10000, 400000],
+        'match_city': ['Paris', '', 'Paris', '', '', 'Valencia', 'Moscow']})
+
+
+def test_enrich_matches_loops(data_by_country, data_by_city, city_population, reference_files):
+    args = (city_population, reference_files['country_pop'], reference_files['missing_countries'],
+            reference_files['gdp'], RENAME_DICT)
+    with object_strings():
+        loop_countries, loop_cities = enrich_loop(data_by_country, data_by_city, *args)
+    countries, cities = process_data.enrich(data_by_country, data_by_city, *args)
+
+    # The outputs are compared as they are written to the CSVs
+    assert countries.to_csv() == loop_countries.to_csv()
+    assert cities.to_csv() == loop_cities.to_csv()
+    assert list(countries['country_long']) == ['France', 'Russia', 'Venezuela', 'Taiwan']
+    assert countries.set_index('country_long').loc['Venezuela', 'gdp_2019'] == 2299
+    assert countries.set_index('country_long').loc['France', 'population'] == 67391582
+    assert list(cities['population'].notna()) == [True, True, True, False, False, False, False]
+
+
+@pytest.mark.skipif(not os.path.isdir(os.path.join(PROCESSING_DIR, 'Data')),
+                    reason='the raw inputs of process_data.py (processing_files/Data) are not committed')
+def test_outputs_match_committed_csvs(tmp_path, monkeypatch):
+    # The stages read and write (ingest_errors.csv) under ./Data, so they are run on a copy of it.
+    # The cities are matched with CityMatcher's default rule, the one the CSVs were produced with
+    shutil.copytree(os.path.join(PROCESSING_DIR, 'Data'), str(tmp_path / 'Data'),
+                    ignore=shutil.ignore_patterns('cache'))
+    monkeypatch.chdir(tmp_path)
+    users_by_account_location = process_data.ingest(process_data.users_path)
+    geocoded_users = process_data.geocode_join(users_by_account_location, process_data.account_location_path)
+    city_population = process_data.load_city_population(process_data.city_population_path)
+    data_by_city = process_data.city_match(geocoded_users, city_population, process_data.manual_matches)
+    data_by_country, data_by_city = process_data.enrich(
+        process_data.country_aggregate(geocoded_users), data_by_city, city_population,
+        process_data.country_pop_path, process_data.missing_countries_path, process_data.gdp_path,
+        process_data.rename_dict)
+
+    for name, output in [('countries', data_by_country), ('cities', data_by_city)]:
+        output_path = str(tmp_path / 'output_{}.csv'.format(name))
+        output.to_csv(output_path)
+        committed = pd.read_csv(os.path.join(VISUALIZATIONS_DIR, 'data', 'twitter_coverage_{}.csv'.format(name)),
+                                index_col=0)
+        pd.testing.assert_frame_equal(pd.read_csv(output_path, index_col=0), committed, check_dtype=False)
@@ -0,0 +1,21 @@
+import importlib
+import sys
+
+from stage_cache import StageCache, helper_files
+
+
+def test_key_follows_helper_modules(tmp_path, monkeypatch):
+    # A stage module and the helper module it calls, as process_data.py and city_matching.py
+    (tmp_path / 'helper.py').write_text('def double(x):\n    return 2 * x\n')
+    (tmp_path / 'stages.py').write_text('from helper import double\n\n\ndef stage(x):\n    return double(x)\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    for name in ['helper', 'stages']:
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    stages = importlib.import_module('stages')
+    cache = StageCache(str(tmp_path / 'cache'))
+
+    assert helper_files(stages.stage) == [str(tmp_path / 'helper.py')]
+    key = cache.key('stage', stages.stage, [1])
+    assert cache.key('stage', stages.stage, [1]) == key
+    (tmp_path / 'helper.py').write_text('def double(x):\n    return x + x\n')
+    assert cache.key('stage', stages.stage, [1]) != key
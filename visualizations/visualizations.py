@@ -1,19 +1,24 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 import folium
+from branca.element import MacroElement, Template
+from folium.plugins import FastMarkerCluster
 import matplotlib.pyplot as plt
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import math
+from plotly.offline import get_plotlyjs
 from plotly.subplots import make_subplots
 
 
-def top_countries_two_axis(data,top_k, fig_name, sort_by_gross_users = True,log_scale = False):
+def top_countries_two_axis(data,top_k, fig_name = None, sort_by_gross_users = True,log_scale = False):
     '''
     Creates a plotly object for the total and relative number of twitter users by country
     Inputs:
         data (dataframe): dataframe grouped by country
         top_k (int): top-k number of countries to plot
+        fig_name (str): name of the HTML file written to ./pictures (nothing is written if None)
         sort_by_gross_users(bool): If True, it sorts the barchart by the gross number of users; if False,
         sorts the barchart by the relative (per 1,000 people) number of users
         log_scale(bool): if True, it plots a log scale for the total number of users; if
@@ -23,10 +28,10 @@ def top_countries_two_axis(data,top_k, fig_name, sort_by_gross_users = True,log_
     '''
     data = data.loc[data["country_long"]!="Antarctica"]
     if sort_by_gross_users:
-        data = data.sort_values("n_users",ascending=False)[:top_k]
+        data = data.nlargest(top_k, "n_users")
         title = "the Total Number of Users"
     else:
-        data = data.sort_values("users_per_K",ascending=False)[:top_k]
+        data = data.nlargest(top_k, "users_per_K")
         title = "the Number of Users per 1,000 people"
 
     if log_scale:
@@ -55,15 +60,17 @@ def top_countries_two_axis(data,top_k, fig_name, sort_by_gross_users = True,log_
                         plot_bgcolor="#f7fafd")
     fig.update_yaxes(title_text='Users (Millions)', secondary_y = False)
     fig.update_yaxes(title_text='Users (per 1,000 people)', secondary_y = True)
-    fig.write_html("./pictures/{}.html".format(fig_name))
+    if fig_name is not None:
+        fig.write_html("./pictures/{}.html".format(fig_name))
     return fig
 
-def top_cities_two_axis(data,top_k, fig_name,sort_by_gross_users = True,log_scale = False):
+def top_cities_two_axis(data,top_k, fig_name = None,sort_by_gross_users = True,log_scale = False):
     '''
     Creates a plotly object for the total and relative number of twitter users by country
     Inputs:
         data (dataframe): dataframe grouped by country
         top_k (int): top-k number of countries to plot
+        fig_name (str): name of the HTML file written to ./pictures (nothing is written if None)
         sort_by_gross_users(bool): If True, it sorts the barchart by the gross number of users; if False,
         sorts the barchart by the relative (per 1,000 people) number of users
         log_scale(bool): if True, it plots a log scale for the total number of users; if
@@ -72,10 +79,10 @@ def top_cities_two_axis(data,top_k, fig_name,sort_by_gross_users = True,log_scal
         Plotly object
     '''
     if sort_by_gross_users:
-        data = data.sort_values("n_users",ascending=False)[:top_k]
+        data = data.nlargest(top_k, "n_users")
         title = "the Total Number of Users"
     else:
-        data = data.sort_values("users_per_K",ascending=False)[:top_k]
+        data = data.nlargest(top_k, "users_per_K")
         title = "the Number of Users per 1,000 people"
 
     if log_scale:
@@ -103,14 +110,16 @@ def top_cities_two_axis(data,top_k, fig_name,sort_by_gross_users = True,log_scal
                         plot_bgcolor="#f7fafd")
     fig.update_yaxes(title_text='Users (Millions)', secondary_y = False)
     fig.update_yaxes(title_text='Users (per 1,000 people)', secondary_y = True)
-    fig.write_html("./pictures/{}.html".format(fig_name))
+    if fig_name is not None:
+        fig.write_html("./pictures/{}.html".format(fig_name))
     return fig
 
-def plot_gdp_and_users(dataframe, fig_name):
+def plot_gdp_and_users(dataframe, fig_name = None):
     '''
     Plots a scatterplot of twitter users per 1k people and GDP per capita (2019)
     Inputs:
         dataframe
+        fig_name (str): name of the HTML file written to ./pictures (nothing is written if None)
     Returns:
         Plotly object
     '''
@@ -135,15 +144,49 @@ def plot_gdp_and_users(dataframe, fig_name):
         hovertemplate = "<br>".join(["Country: %{text}",
             "GDP per capita: %{x:,.0f}" + "<extra></extra>",
             "Users per 1,000 people: %{y:,.2f}"]))
-    fig.write_html("./pictures/{}.html".format(fig_name))
+    if fig_name is not None:
+        fig.write_html("./pictures/{}.html".format(fig_name))
     return fig
 
-def dot_maps(dataframe,map_name,total_users = True):
+class CircleMarkerLayer(MacroElement):
+    '''
+    Folium layer drawing circle markers on a canvas, from a single array of [lat, lon, radius, tooltip]
+    points embedded in the map, instead of one folium object (and block of javascript) per marker
+    Inputs:
+        points (list): [lat, lon, radius, tooltip] lists
+        options: leaflet options of the markers (e.g. fillOpacity=0.5)
+    '''
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.layerGroup();
+            var {{ this.get_name() }}_renderer = L.canvas();
+            {{ this.points }}.forEach(function (point) {
+                var options = Object.assign({radius: point[2], renderer: {{ this.get_name() }}_renderer},
+                                            {{ this.options }});
+                L.circleMarker([point[0], point[1]], options).bindTooltip(point[3]).addTo({{ this.get_name() }});
+            });
+            {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """)
+
+    def __init__(self, points, **options):
+        super(CircleMarkerLayer, self).__init__()
+        self._name = 'CircleMarkerLayer'
+        # '</' would end the script tag
+        self.points = json.dumps(points).replace('</', '<\\/')
+        self.options = json.dumps(options)
+
+def dot_maps(dataframe,map_name,total_users = True, single_layer = True, cluster = False):
     '''
     Plots a dot map with total users OR users per 1k people
     Inputs:
         dataframe (pandas dataframe): dataframe of cities
         total_users(bool): If True, uses total number of users. If False, uses users per 1k people
+        single_layer(bool): If True, all the cities are drawn by a single CircleMarkerLayer; if False,
+        one folium CircleMarker is added per city, which makes the map slow to build and to open
+        beyond a few thousand cities
+        cluster(bool): If True, nearby cities are grouped into clusters that split as the map is
+        zoomed in
     Returns:
         Folium object
         
@@ -155,19 +198,38 @@ def dot_maps(dataframe,map_name,total_users = True):
     map_city = folium.Map( location = [0,0], 
                           zoom_start=2, 
                           tiles='cartodbpositron')
-    for country in dataframe.country_long.unique():
-        for i, (city, lat, lon, users) in enumerate(zip(
-        dataframe.loc[dataframe.country_long==country,'locality_long'],
-        dataframe.loc[dataframe.country_long==country,'latitude'],
-        dataframe.loc[dataframe.country_long==country,'longitude'],
-        dataframe.loc[dataframe.country_long==country,'{}'.format(var)])):
+    # Cities grouped by country, in the order in which the countries first appear (cities without a
+    # country are left out)
+    codes = pd.factorize(dataframe['country_long'])[0]
+    order = np.argsort(codes, kind='stable')
+    cities = dataframe.iloc[order[codes[order] >= 0]]
+    users = cities[var]
+    if total_users:
+        radius = 0.01*np.sqrt(users)
+        tooltip = cities['locality_long'].str.title() + ' (' + users.astype(str) + ' Users)'
+    else:
+        radius = 0.05*users
+        tooltip = cities['locality_long'].str.title() + ' (' + users.map('{0:.2f}'.format) + ' Users per 1K people)'
+    points = list(zip(cities['latitude'].round(5).tolist(), cities['longitude'].round(5).tolist(),
+                      radius.round(2).tolist(), tooltip.tolist()))
+
+    if cluster:
+        callback = """function (row) {
+            return L.circleMarker(new L.LatLng(row[0], row[1]),
+                                  {radius: row[2], fill: true, fillOpacity: 0.5, color: 'k'}).bindTooltip(row[3]);
+        }"""
+        FastMarkerCluster(points, callback=callback).add_to(map_city)
+    elif single_layer:
+        CircleMarkerLayer(points, fill=True, fillOpacity=0.5, color='k').add_to(map_city)
+    else:
+        for lat, lon, city_radius, city_tooltip in points:
             folium.CircleMarker(
             [lat, lon],
-            radius= 0.01*math.sqrt(users) if total_users else  0.05*(users) ,
+            radius= city_radius,
             fill=True,
             fill_opacity=0.5,
             color='k',
-            tooltip = city.title() + ' (' + '{}'.format(users) + ' Users)' if total_users else city.title() + ' (' + '{0:.2f}'.format(users) + ' Users per 1K people)' 
+            tooltip = city_tooltip
             ).add_to(map_city)
     map_city.save("./pictures/{}.html".format(map_name))
                
@@ -193,7 +255,7 @@ def top_countries(data,top_k_countries,gross_users = True,log_scale = False):
         scale = 'linear'
         log_title = ""
     if gross_users:
-        data = data.sort_values("n_users",ascending=False)[:top_k_countries]
+        data = data.nlargest(top_k_countries, "n_users")
         x = data["country_long"]
         y = data["n_users"]
         fig = go.Figure([go.Bar(x = x, y = y, marker_color='rgb(55, 83, 109)', 
@@ -207,7 +269,7 @@ def top_countries(data,top_k_countries,gross_users = True,log_scale = False):
                       yaxis={'title':'Users (Millions {})'.format(log_title), 'type':'{}'.format(scale)},
                         plot_bgcolor="#f7fafd")
     else:
-        data = data[data["country_long"]!="Antarctica"].sort_values("users_per_K", ascending=False)[:top_k_countries]
+        data = data[data["country_long"]!="Antarctica"].nlargest(top_k_countries, "users_per_K")
         x = data["country_long"]
         y = data["users_per_K"] 
         fig = go.Figure([go.Bar(x = x, y = y, marker_color='rgb(55, 83, 109)',
@@ -244,7 +306,7 @@ def top_cities(data,top_k_cities,gross_users = True,log_scale = False):
         log_title = ""
     
     if gross_users:
-        data = data.sort_values("n_users",ascending=False)[:top_k_cities]
+        data = data.nlargest(top_k_cities, "n_users")
         x = data["locality_long"]
         y = data["n_users"]
         fig = go.Figure([go.Bar(x = x, y = y, marker_color='#E68848', 
@@ -258,7 +320,7 @@ def top_cities(data,top_k_cities,gross_users = True,log_scale = False):
                       yaxis={'title':'Users (Millions {})'.format(log_title), 'type':'{}'.format(scale)},
                         plot_bgcolor="#f7fafd")
     else:
-        data = data[data["country_long"]!="Antarctica"].sort_values("users_per_K", ascending=False)[:top_k_cities]
+        data = data[data["country_long"]!="Antarctica"].nlargest(top_k_cities, "users_per_K")
         x = data["locality_long"]
         y = data["users_per_K"] 
         fig = go.Figure([go.Bar(x = x, y = y, marker_color='#E68848',
@@ -272,4 +334,84 @@ def top_cities(data,top_k_cities,gross_users = True,log_scale = False):
                       yaxis={'title':'Users (per 1,000 people)', 'type':'{}'.format(scale)},
                          plot_bgcolor="#f7fafd")
 
-    return fig
\ No newline at end of file
+    return fig
+
+
+# Figure -> (builder, table it plots, name of its top-k argument, name of its sorting flag)
+REPORT_FIGURES = {
+    'top_countries_two_axis': (top_countries_two_axis, 'countries', 'top_k', 'sort_by_gross_users'),
+    'top_cities_two_axis': (top_cities_two_axis, 'cities', 'top_k', 'sort_by_gross_users'),
+    'top_countries': (top_countries, 'countries', 'top_k_countries', 'gross_users'),
+    'top_cities': (top_cities, 'cities', 'top_k_cities', 'gross_users'),
+    'plot_gdp_and_users': (plot_gdp_and_users, 'countries', None, None),
+}
+
+def _render_figure(task):
+    figure, data, kwargs, path = task
+    fig = REPORT_FIGURES[figure][0](data, **kwargs)
+    # The figures load the plotly.js written next to them by CoverageReport.render
+    fig.write_html(path, include_plotlyjs='plotly.min.js')
+    return path
+
+class CoverageReport:
+    '''
+    Renders a batch of figures from the coverage CSVs, which are read once. The rows of the top-k
+    charts are ranked once per table and metric, and all the figures share one copy of plotly.js
+    Inputs:
+        countries_path (str): path of twitter_coverage_countries.csv
+        cities_path (str): path of twitter_coverage_cities.csv
+    '''
+
+    def __init__(self, countries_path, cities_path):
+        self.tables = {'countries': pd.read_csv(countries_path, index_col=0),
+                       'cities': pd.read_csv(cities_path, index_col=0)}
+
+    def ranked_rows(self, figures):
+        '''
+        Ranks each table once per metric used by the figures, keeping the rows of the largest top-k
+        requested plus the Antarctica rows, which some of the charts leave out
+        Returns:
+            Dictionary (table, metric) -> dataframe sorted by metric
+        '''
+        sizes = {}
+        for _, figure, kwargs in figures:
+            _, table, top_k_arg, sort_arg = REPORT_FIGURES[figure]
+            if top_k_arg is not None:
+                metric = 'n_users' if kwargs.get(sort_arg, True) else 'users_per_K'
+                sizes[(table, metric)] = max(sizes.get((table, metric), 0), kwargs[top_k_arg])
+        ranked = {}
+        for (table, metric), top_k in sizes.items():
+            data = self.tables[table]
+            top_k += (data['country_long'] == 'Antarctica').sum()
+            ranked[(table, metric)] = data.nlargest(top_k, metric)
+        return ranked
+
+    def render(self, figures, output_dir='./pictures', n_workers=1):
+        '''
+        Writes the figures as HTML files
+        Inputs:
+            figures (list): (fig_name, figure, kwargs) tuples, where figure is a key of REPORT_FIGURES
+            and kwargs are the arguments of its builder other than the data, e.g.
+            ('bar_user_country', 'top_countries_two_axis', {'top_k': 20})
+            output_dir (str): folder of the HTML files
+            n_workers (int): number of processes rendering the figures
+        Returns:
+            List of the paths of the HTML files
+        '''
+        os.makedirs(output_dir, exist_ok=True)
+        with open(os.path.join(output_dir, 'plotly.min.js'), 'w', encoding='utf-8') as file:
+            file.write(get_plotlyjs())
+        ranked = self.ranked_rows(figures)
+        tasks = []
+        for fig_name, figure, kwargs in figures:
+            _, table, top_k_arg, sort_arg = REPORT_FIGURES[figure]
+            if top_k_arg is None:
+                data = self.tables[table]
+            else:
+                metric = 'n_users' if kwargs.get(sort_arg, True) else 'users_per_K'
+                data = ranked[(table, metric)]
+            tasks.append((figure, data, kwargs, os.path.join(output_dir, '{}.html'.format(fig_name))))
+        if n_workers > 1:
+            with ProcessPoolExecutor(n_workers) as executor:
+                return list(executor.map(_render_figure, tasks))
+        return list(map(_render_figure, tasks))